@@ -1,54 +1,163 @@
 from openai import OpenAI
-from langchain import hub
 import streamlit as st
-from langchain_chroma import Chroma
-from langchain_openai import ChatOpenAI, OpenAIEmbeddings
-from langchain.prompts import ChatPromptTemplate
+from langchain_core.prompts import ChatPromptTemplate
 import json
-import os
-from dotenv import load_dotenv
+import logging
+import orjson
+import time
+from concurrent.futures import ThreadPoolExecutor
 
+from config import settings
 from function_calls import (
-    get_consequence_info,
+    DISPATCH,
+    is_tool_error,
+    route_prompt,
+    run_tool_call,
     tools,
-    get_clinical_info,
-    show_literature,
-    get_gene_name,
+    variant_mentions,
+)
+from batch_annotation import (
+    build_batch_requests,
+    build_tool_followups,
+    read_batch_output,
+    submit_batch,
 )
 
-load_dotenv()
+# Loads .env and the LangSmith tracing environment before LangChain is used
+settings()
 
-os.environ["OPENAI_API_KEY"] = os.getenv("OPENAI_API_KEY")
-os.environ["LANGSMITH_TRACING"] = "true"
-os.environ["LANGCHAIN_TRACING_V2"] = "true"
-os.environ["LANGSMITH_ENDPOINT"] = "https://api.smith.langchain.com"
-os.environ["LANGSMITH_API_KEY"] = os.getenv("LANGSMITH_API_KEY")
-os.environ["LANGSMITH_PROJECT"] = "RAG_Variant_Interpretation_Assistant"
+logger = logging.getLogger(__name__)
 
 PERSIST_DIR = "./chroma_langchain_db"
 COLLECTION_NAME = "variant_annotation_kb"
+# Model the shipped knowledge base was embedded with (see RAG.ipynb); queries must use the same one
+EMBEDDING_MODEL = "text-embedding-ada-002"
+# HNSW index settings, applied when a collection is created (see RAG.ipynb)
+HNSW_METADATA = {
+    "hnsw:space": "cosine",
+    "hnsw:construction_ef": 200,
+    "hnsw:M": 32,
+    "hnsw:search_ef": 64,
+}
+EMBEDDINGS_CACHE_DIR = "./emb_cache"
+ANSWER_CACHE_DIR = "./qcache"
+ANSWER_CACHE_COLLECTION = "qcache"
+# Cosine distance below which a previous question counts as the same one (similarity >= 0.97)
+ANSWER_CACHE_MAX_DISTANCE = 0.03
+# Seconds a cached answer is served, matching the variant lookup cache in function_calls
+ANSWER_CACHE_TTL = 3600
 LLM = "gpt-3.5-turbo"
 
+@st.cache_resource
+def load_embeddings():
+    """OpenAI embeddings with query and document vectors cached on disk."""
+    from langchain_classic.embeddings import CacheBackedEmbeddings
+    from langchain_classic.storage import LocalFileStore
+    from langchain_openai import OpenAIEmbeddings
+
+    embeddings = OpenAIEmbeddings(model=EMBEDDING_MODEL)
+    return CacheBackedEmbeddings.from_bytes_store(
+        embeddings,
+        LocalFileStore(EMBEDDINGS_CACHE_DIR),
+        namespace=EMBEDDING_MODEL,
+        query_embedding_cache=True,
+        key_encoder="sha256",
+    )
+
+
 @st.cache_resource
 def load_vectorstore():
-    embeddings = OpenAIEmbeddings()
-    vectorstore = Chroma(
+    from langchain_chroma import Chroma
+
+    return Chroma(
         collection_name=COLLECTION_NAME,
-        embedding_function=embeddings,
+        embedding_function=load_embeddings(),
         persist_directory=PERSIST_DIR,
+        collection_metadata=HNSW_METADATA,
     )
-    return vectorstore
 
-vectorstore = load_vectorstore()
-retriever = vectorstore.as_retriever(search_kwargs={"k": 3})
 
-llm = ChatOpenAI(model=LLM, temperature=0)
+@st.cache_resource
+def load_answer_cache():
+    """Semantic cache of answered questions, shared by all sessions.
 
-RAG_PROMPT = ChatPromptTemplate.from_template(
+    Uses the knowledge base's embeddings, so the prompt embedding of the
+    cache lookup is reused by retrieval.
     """
+    from langchain_chroma import Chroma
+
+    return Chroma(
+        collection_name=ANSWER_CACHE_COLLECTION,
+        embedding_function=load_embeddings(),
+        persist_directory=ANSWER_CACHE_DIR,
+        collection_metadata=HNSW_METADATA,
+    )
+
+vectorstore = load_vectorstore()
+retriever = vectorstore.as_retriever(
+    search_type="mmr", search_kwargs={"k": 3, "fetch_k": 10, "lambda_mult": 0.5}
+)
+answer_cache = load_answer_cache()
+
+# Kept identical across requests and placed first, so OpenAI can serve it from
+# the prompt cache (prefixes over 1024 tokens); per-query content goes last.
+SYSTEM_PROMPT = """
 You are VariantAI, a helpful assistant for genomic variant interpretation.
+You support researchers and clinicians who analyse human sequence variants.
 Answer user questions using the provided context. If the answer is not in context, say you don’t know.
 
+## Role
+- Explain what is known about a variant, a gene or an interpretation concept in clear, precise language.
+- Ground every statement in the retrieved context or in results returned by the tools.
+- Never invent variant identifiers, gene names, consequences, classifications, publications or links.
+- When the context and the tool results disagree, report both and say which source each comes from.
+- Keep a neutral, scientific tone. Do not speculate about a specific patient.
+
+## Knowledge base
+The retrieved context comes from a curated knowledge base that includes:
+- ACMG/AMP standards and guidelines for the interpretation of sequence variants.
+- Guidance on using population databases such as gnomAD for variant interpretation.
+- Reviews of the path from genetic variant identification to clinical interpretation.
+- Animal variant classification guidelines and work on GPT models for genomics analysis.
+- ClinVar documentation and HGVS nomenclature background pages.
+Treat the context as the primary source for definitions, criteria and methodology.
+
+## Variant nomenclature
+- Variants are described using HGVS genomic notation, e.g. 'chr9:g.107620835G>A' or 'chr1:g.11856378G>A'.
+- The chromosome comes first ('chr1' to 'chr22', 'chrX', 'chrY', 'chrM'), followed by ':g.', the position and the reference and alternate alleles.
+- If the user gives a variant in another format (rsID, transcript 'c.' notation, protein 'p.' notation) and a tool requires the genomic form, say so and ask for the genomic HGVS identifier instead of guessing the conversion.
+- Repeat the variant identifier exactly as the user wrote it when you refer to it.
+
+## Tools
+You can call the following tools. Call a tool only when the question needs data that the context cannot provide.
+- get_clinical_info: clinical significance of one variant as reported in ClinVar records from myvariant.info.
+- get_consequence_info: predicted genetic consequences of one variant from CADD annotations.
+- get_gene_name: gene or genes that a variant is located in or associated with, from CADD annotations.
+- show_literature: links to publications from Google Scholar for a variant, gene or topic.
+When a question covers several aspects of the same variant (for example its gene, consequence and clinical significance), call all the relevant tools in the same turn.
+Pass the variant identifier to the tools exactly as written by the user.
+Tool results are JSON objects. Phrase them in natural language instead of quoting the JSON.
+If a tool result contains an "error" field, tell the user, suggest checking the variant identifier, and do not fill the gap with assumptions.
+
+## Answer policy
+1. Start with a direct answer to the question in one or two sentences.
+2. Follow with the supporting details: classification terms, consequences, genes or definitions, quoting the exact terms returned by the sources.
+3. For clinical significance, summarise the reported classifications (for example Pathogenic, Likely pathogenic, Uncertain significance, Likely benign, Benign) and mention conflicting interpretations if several different terms are reported.
+4. When explaining classification criteria, refer to the ACMG/AMP evidence categories (very strong, strong, moderate and supporting evidence for pathogenicity; stand-alone, strong and supporting evidence for benign impact) as described in the context.
+5. When discussing population frequency, remember that allele frequency alone rarely classifies a variant and that ancestry-specific frequencies matter, as described in the gnomAD guidance.
+6. Present literature as a short list of links returned by the show_literature tool, without inventing titles or authors.
+7. Keep answers concise. Use short paragraphs or bullet points, and Markdown formatting where it helps readability.
+8. If the question is unrelated to genetics or variant interpretation, say that it is outside the scope of VariantAI.
+9. If you don't know the answer, say you don’t know rather than guessing.
+
+## Safety
+- VariantAI is for research use only. Its answers are informational and are not a diagnosis or medical advice.
+- Do not recommend treatment or clinical management. For clinical decisions, recommend consulting a clinical geneticist or genetic counsellor and the primary databases.
+- Do not ask for or repeat personal or identifying patient information.
+"""
+
+RAG_PROMPT = ChatPromptTemplate.from_template(
+    """
 Context:
 {context}
 
@@ -57,7 +166,186 @@ Question:
 """
 )
 
-client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+client = OpenAI(api_key=settings().openai_api_key)
+
+
+@st.cache_resource
+def warm_up():
+    """Pays one-off start-up costs (tiktoken encoder, HTTPS connections) before the first question."""
+    import tiktoken
+
+    def warm_vectorstore():
+        # Embed through the uncached model: a query embedding cached on disk would skip the OpenAI client
+        vector = vectorstore.embeddings.underlying_embeddings.embed_query("warmup")
+        vectorstore.similarity_search_by_vector(vector, k=1)
+
+    steps = {
+        "tiktoken encoder": lambda: tiktoken.encoding_for_model(LLM),
+        "embeddings and vector store": warm_vectorstore,
+        "OpenAI client": client.models.list,
+    }
+    # Best-effort: a failure here must not keep the page from rendering, but is reported
+    for name, step in steps.items():
+        try:
+            step()
+        except Exception as e:
+            logger.warning("Warm-up of the %s failed: %s", name, e)
+
+warm_up()
+
+
+def generate_answer(prompt, tool_results=None):
+    """Runs retrieval, the LLM and any requested tools for a user prompt.
+
+    Yields the answer text as it arrives, for rendering with st.write_stream.
+    The raw tool results are appended to tool_results, if given.
+    """
+    route = route_prompt(prompt)
+    # Retrieval and a locally routed tool are independent network calls, so run them together
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        docs_future = executor.submit(retriever.invoke, prompt)
+        if route:
+            tool_future = executor.submit(DISPATCH[route[0]], **route[1])
+
+    context_text = "\n\n".join(d.page_content for d in docs_future.result())
+    rag_prompt = RAG_PROMPT.format(context=context_text, question=prompt)
+
+    if route:
+        # Unambiguous prompt: use the tool result directly and skip the LLM routing round-trip
+        fn_name, fn_args = route
+        tool_call_id = "call_local_router"
+        message = {
+            "role": "assistant",
+            "content": None,
+            "tool_calls": [
+                {
+                    "id": tool_call_id,
+                    "type": "function",
+                    "function": {"name": fn_name, "arguments": json.dumps(fn_args)},
+                }
+            ],
+        }
+        tool_msgs = [
+            {
+                "role": "tool",
+                "tool_call_id": tool_call_id,
+                "content": tool_future.result(),
+            }
+        ]
+    else:
+        completion = client.chat.completions.create(
+            model=LLM,
+            messages=[
+                {
+                    "role": "system",
+                    "content": SYSTEM_PROMPT,
+                },
+                {"role": "user", "content": str(rag_prompt)},
+            ],
+            tools=tools
+        )
+
+        message = completion.choices[0].message
+        if not getattr(message, "tool_calls", None):
+            if message.content:
+                yield message.content
+            return
+
+        # Tools are I/O-bound (myvariant.info, SerpApi), so threads overlap the network waits
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            futures = [
+                (
+                    tool_call,
+                    executor.submit(
+                        run_tool_call,
+                        tool_call.function.name,
+                        tool_call.function.arguments,
+                    ),
+                )
+                for tool_call in message.tool_calls
+            ]
+
+        # Every tool_call of the assistant turn needs its tool message in one follow-up request
+        tool_msgs = [
+            {
+                "role": "tool",
+                "tool_call_id": tool_call.id,
+                "content": future.result(),
+            }
+            for tool_call, future in futures
+        ]
+
+    if tool_results is not None:
+        tool_results.extend(tool_msg["content"] for tool_msg in tool_msgs)
+
+    # The routing call stays blocking since tool_calls are needed in full; the answer is streamed
+    stream = client.chat.completions.create(
+        model=LLM,
+        messages=[
+            {
+                "role": "system",
+                "content": SYSTEM_PROMPT,
+            },
+            {"role": "user", "content": rag_prompt},
+            message,
+            *tool_msgs,
+        ],
+        stream=True,
+    )
+    for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+
+def start_batch_job(questions):
+    """Submits RAG prompts for all questions as an OpenAI Batch API job."""
+    prompts = [
+        str(RAG_PROMPT.format(
+            context="\n\n".join(d.page_content for d in docs), question=question
+        ))
+        for question, docs in zip(questions, retriever.batch(questions))
+    ]
+    requests = build_batch_requests(prompts, SYSTEM_PROMPT, LLM)
+    return {
+        "questions": questions,
+        "requests": requests,
+        "batch_id": submit_batch(client, requests).id,
+        "status": "submitted",
+        "progress": 0.0,
+        "answers": {},
+    }
+
+
+def update_batch_job(job):
+    """Refreshes the batch job status and collects answers once it completes.
+
+    Answers that requested tools get the tool results in a second batch.
+    """
+    batch = client.batches.retrieve(job["batch_id"])
+    job["status"] = batch.status
+    counts = batch.request_counts
+    if counts and counts.total:
+        job["progress"] = (counts.completed + counts.failed) / counts.total
+
+    if batch.status == "completed":
+        messages = read_batch_output(client, batch)
+        for custom_id, message in messages.items():
+            if message is None:
+                job["answers"][custom_id] = "Request failed"
+            elif not message.get("tool_calls"):
+                job["answers"][custom_id] = message.get("content")
+
+        followups = build_tool_followups(job["requests"], messages)
+        if followups:
+            job["requests"] = followups
+            job["batch_id"] = submit_batch(client, followups).id
+            job["status"] = "running tools"
+            job["progress"] = 0.0
+        else:
+            job["batch_id"] = None
+    elif batch.status in ("failed", "expired", "cancelled"):
+        job["batch_id"] = None
+
 
 st.set_page_config(page_title="VariantAI", page_icon="🧬", layout="centered")
 st.title("🧬 VariantAI - Genomic Variant Interpreter")
@@ -94,77 +382,99 @@ st.sidebar.header("Settings")
 
 if st.sidebar.button("🔄 Restart Chat"):
     st.session_state["messages"] = []
+# Serialized only when the button is clicked, not on every rerun
+chat_messages = st.session_state["messages"]
 st.sidebar.download_button(
     "🔽 Download Chat",
-    data=json.dumps(st.session_state["messages"]),
+    data=lambda: orjson.dumps(chat_messages),
     file_name="chat_history.json",
+    # Downloading does not change the app, so skip the rerun that would replay the chat
+    on_click="ignore",
 )
 
+
+@st.fragment
+def bulk_annotation_panel():
+    """Bulk annotation controls; interacting with them reruns only this panel, not the chat."""
+    st.header("Bulk annotation")
+    st.caption(
+        "Upload a TXT file with one variant or question per line. Answers are generated \
+with the OpenAI Batch API at half the price and can take up to 24 hours."
+    )
+    uploaded_file = st.file_uploader("Variants / questions", type="txt")
+    if uploaded_file and st.button("📤 Submit Batch"):
+        questions = [
+            line.strip()
+            for line in uploaded_file.getvalue().decode("utf-8").splitlines()
+            if line.strip()
+        ]
+        if questions:
+            st.session_state["batch_job"] = start_batch_job(questions)
+
+    if job := st.session_state.get("batch_job"):
+        if job["batch_id"] and st.button("🔄 Check Batch Status"):
+            update_batch_job(job)
+        st.progress(job["progress"], text=f"Batch status: {job['status']}")
+        if not job["batch_id"] and job["answers"]:
+            st.download_button(
+                "🔽 Download Batch Results",
+                data=json.dumps(
+                    [
+                        {"question": question, "answer": job["answers"].get(str(i))}
+                        for i, question in enumerate(job["questions"])
+                    ]
+                ),
+                file_name="batch_results.json",
+                on_click="ignore",
+            )
+
+with st.sidebar:
+    bulk_annotation_panel()
+
 for msg in st.session_state.messages:
     st.chat_message(msg["role"]).markdown(msg["content"])
 
 if prompt := st.chat_input("Ask about a genetic variant..."):
     st.session_state.messages.append({"role": "user", "content": prompt})
     st.chat_message("user").markdown(prompt)
-    
-    docs = retriever.get_relevant_documents(prompt)
-    context_text = "\n\n".join([d.page_content for d in docs])
-    rag_prompt = RAG_PROMPT.format(context=context_text, question=prompt)
 
-    completion = client.chat.completions.create(
-        model=LLM,
-        messages=[
-            {
-                "role": "system",
-                "content": "You are VariantAI, a genomic variant interpreter.",
+    # Near-identical prompts about different variants embed almost the same, so only
+    # answers about exactly the same variants are reused, and only while still fresh
+    variants = variant_mentions(prompt)
+    with st.chat_message("assistant"):
+        hits = answer_cache.similarity_search_with_score(
+            prompt,
+            k=1,
+            filter={
+                "$and": [
+                    {"variants": variants},
+                    {"created_at": {"$gte": time.time() - ANSWER_CACHE_TTL}},
+                ]
             },
-            {"role": "user", "content": str(rag_prompt)},
-        ],
-        tools=tools
-    )
-
-    message = completion.choices[0].message
-    
-    if getattr(message, "tool_calls", None):
-        for tool_call in message.tool_calls:
-            fn_name = tool_call.function.name
-            fn_args = json.loads(tool_call.function.arguments)
-
-            if fn_name == "show_literature":
-                tool_result = show_literature(**fn_args)
-            elif fn_name == "get_clinical_info":
-                tool_result = get_clinical_info(**fn_args)
-            elif fn_name == "get_consequence_info":
-                tool_result = get_consequence_info(**fn_args)
-            elif fn_name == "get_gene_name":
-                tool_result = get_gene_name(**fn_args)
-            else:
-                tool_result = f"Unknown tool"
-
-            completion_final = client.chat.completions.create(
-                model=LLM,
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "You are VariantAI, a genomic variant interpreter.",
-                    },
-                    {"role": "user", "content": rag_prompt},
-                    message,
-                    {
-                        "role": "tool",
-                        "tool_call_id": tool_call.id,
-                        "content": tool_result,
-                    },
-                ],
-            )
-            final_answer = completion_final.choices[0].message.content
-            st.session_state.messages.append(
-                {"role": "assistant", "content": final_answer}
-            )
-            st.chat_message("assistant").markdown(final_answer)
-
-    else:
-        st.session_state.messages.append(
-            {"role": "assistant", "content": message.content}
         )
-        st.chat_message("assistant").markdown(message.content)
+        if hits and hits[0][1] < ANSWER_CACHE_MAX_DISTANCE:
+            final_answer = hits[0][0].metadata["answer"]
+            st.markdown(final_answer)
+        else:
+            tool_results = []
+            final_answer = st.write_stream(generate_answer(prompt, tool_results))
+            # Failed lookups (e.g. an API outage) must not be served from the cache
+            if final_answer and not any(map(is_tool_error, tool_results)):
+                # Expired answers are never served again, so drop them instead of letting qcache grow
+                answer_cache.delete(
+                    where={"created_at": {"$lt": time.time() - ANSWER_CACHE_TTL}}
+                )
+                answer_cache.add_texts(
+                    [prompt],
+                    metadatas=[
+                        {
+                            "answer": final_answer,
+                            "variants": variants,
+                            "created_at": time.time(),
+                        }
+                    ],
+                )
+
+    st.session_state.messages.append(
+        {"role": "assistant", "content": final_answer}
+    )
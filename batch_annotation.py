@@ -0,0 +1,142 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+from function_calls import run_tool_call, tools
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+COMPLETION_WINDOW = "24h"
+
+
+def build_batch_requests(prompts: list, system_prompt: str, model: str, with_tools: bool = True) -> list:
+    """Builds Batch API request lines, one chat completion per prompt.
+
+    :param prompts: user prompts (RAG prompts) indexed by position
+    :type prompts: list
+    :param system_prompt: system message shared by all requests
+    :type system_prompt: str
+    :param model: chat model name
+    :type model: str
+    :param with_tools: whether to offer the function-calling tools
+    :type with_tools: bool
+    :return: request lines with the prompt position as custom_id
+    :rtype: list
+    """
+    requests = []
+    for i, prompt in enumerate(prompts):
+        body = {
+            "model": model,
+            "messages": [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": prompt},
+            ],
+        }
+        if with_tools:
+            body["tools"] = tools
+        requests.append(
+            {
+                "custom_id": str(i),
+                "method": "POST",
+                "url": BATCH_ENDPOINT,
+                "body": body,
+            }
+        )
+    return requests
+
+
+def submit_batch(client, requests: list):
+    """Uploads request lines as a JSONL file and starts a batch job.
+
+    :param client: OpenAI client
+    :param requests: request lines, see build_batch_requests
+    :type requests: list
+    :return: created batch object
+    """
+    jsonl = "\n".join(json.dumps(request) for request in requests)
+    batch_file = client.files.create(
+        file=("batch_input.jsonl", jsonl.encode("utf-8")), purpose="batch"
+    )
+    return client.batches.create(
+        input_file_id=batch_file.id,
+        endpoint=BATCH_ENDPOINT,
+        completion_window=COMPLETION_WINDOW,
+    )
+
+
+def read_batch_output(client, batch) -> dict:
+    """Downloads the output of a completed batch job.
+
+    :param client: OpenAI client
+    :param batch: completed batch object
+    :return: assistant messages by custom_id, None for failed requests
+    :rtype: dict
+    """
+    messages = {}
+    for file_id in (batch.output_file_id, batch.error_file_id):
+        if not file_id:
+            continue
+        for line in client.files.content(file_id).text.splitlines():
+            if not line.strip():
+                continue
+            result = json.loads(line)
+            response = result.get("response") or {}
+            if result.get("error") or response.get("status_code") != 200:
+                messages[result["custom_id"]] = None
+            else:
+                messages[result["custom_id"]] = response["body"]["choices"][0]["message"]
+    return messages
+
+
+def build_tool_followups(requests: list, messages: dict) -> list:
+    """Runs the tools requested in batch answers and builds follow-up requests.
+
+    :param requests: request lines of the finished batch
+    :type requests: list
+    :param messages: assistant messages by custom_id, see read_batch_output
+    :type messages: dict
+    :return: request lines answering the tool calls, without tools offered
+    :rtype: list
+    """
+    pending = [
+        (request, messages[request["custom_id"]])
+        for request in requests
+        if messages.get(request["custom_id"])
+        and messages[request["custom_id"]].get("tool_calls")
+    ]
+
+    # Tools are I/O-bound (myvariant.info, SerpApi), so threads overlap the network waits
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        futures = [
+            [
+                (
+                    tool_call,
+                    executor.submit(
+                        run_tool_call,
+                        tool_call["function"]["name"],
+                        tool_call["function"]["arguments"],
+                    ),
+                )
+                for tool_call in message["tool_calls"]
+            ]
+            for _, message in pending
+        ]
+
+    followups = []
+    for (request, message), tool_futures in zip(pending, futures):
+        tool_msgs = [
+            {
+                "role": "tool",
+                "tool_call_id": tool_call["id"],
+                "content": future.result(),
+            }
+            for tool_call, future in tool_futures
+        ]
+        body = {
+            key: value for key, value in request["body"].items() if key != "tools"
+        }
+        assistant_msg = {
+            "role": "assistant",
+            "content": message.get("content"),
+            "tool_calls": message["tool_calls"],
+        }
+        body["messages"] = [*body["messages"], assistant_msg, *tool_msgs]
+        followups.append({**request, "body": body})
+    return followups
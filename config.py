@@ -0,0 +1,38 @@
+import os
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Optional
+from dotenv import load_dotenv
+
+
+@dataclass(frozen=True)
+class Settings:
+    openai_api_key: Optional[str]
+    serp_api_key: Optional[str]
+    langsmith_api_key: Optional[str]
+
+
+@lru_cache(maxsize=1)
+def settings() -> Settings:
+    """Loads the configuration from the environment and .env once per process.
+
+    Streamlit re-executes app.py on every rerun, but imported modules persist,
+    so .env is parsed and the environment is modified only on the first call.
+
+    :return: API keys of the external services
+    :rtype: Settings
+    """
+    load_dotenv()
+    config = Settings(
+        openai_api_key=os.getenv("OPENAI_API_KEY"),
+        serp_api_key=os.getenv("SERP_API_KEY"),
+        langsmith_api_key=os.getenv("LANGSMITH_API_KEY"),
+    )
+
+    # LangChain reads the tracing settings from the environment
+    if config.langsmith_api_key:
+        os.environ["LANGSMITH_TRACING"] = "true"
+        os.environ["LANGCHAIN_TRACING_V2"] = "true"
+        os.environ["LANGSMITH_ENDPOINT"] = "https://api.smith.langchain.com"
+        os.environ["LANGSMITH_PROJECT"] = "RAG_Variant_Interpretation_Assistant"
+    return config
@@ -1,34 +1,90 @@
-import os
+import json
+import re
+import httpx
+from threading import Condition
+from cachetools import TTLCache, cached
 from serpapi import GoogleSearch
-from dotenv import load_dotenv
 from myvariant import MyVariantInfo
+from config import settings
 
-load_dotenv()
-SERP_API_KEY = os.getenv("SERP_API_KEY")
+# Only the fields read by the tools below, fetched together so one cached document serves all of them
+VARIANT_FIELDS = [
+    "clinvar.rcv.clinical_significance",
+    "cadd.consequence",
+    "cadd.gene.genename",
+]
+
+# One shared client, so HTTP connections are reused between tool calls
+_MV = MyVariantInfo()
+# biothings_client builds its httpx client lazily; provide a pooled one with retries instead
+_MV.http_client = httpx.Client(
+    timeout=httpx.Timeout(10.0),
+    transport=httpx.HTTPTransport(
+        retries=2,
+        limits=httpx.Limits(max_connections=16, max_keepalive_connections=4),
+    ),
+)
+_MV.http_client_setup = True
+
+
+# A condition (not a lock) makes concurrent misses for the same variant wait for one fetch
+@cached(cache=TTLCache(maxsize=1024, ttl=3600), condition=Condition())
+def _fetch_variant(variant_id: str) -> dict:
+    """Fetches a variant document from myvariant.info, cached for an hour.
+
+    The cache is shared between Streamlit sessions, so repeated questions
+    about the same variant do not hit the API again.
+
+    :param variant_id: variant identifier, e.g. 'chr9:g.107620835G>A'
+    :type variant_id: str
+    :return: variant document restricted to VARIANT_FIELDS, empty if the variant is not found
+    :rtype: dict
+    """
+    return _MV.getvariant(variant_id, fields=VARIANT_FIELDS) or {}
+
+
+def _to_json(data: dict) -> str:
+    """Serializes a tool result as compact JSON, keeping the tokens sent to the LLM low."""
+    return json.dumps(data, separators=(",", ":"))
 
 
 # 1. Literature lookup via Google Scholar (SerpApi)
+@cached(cache=TTLCache(maxsize=256, ttl=3600), condition=Condition())
+def _search_scholar(query: str) -> tuple:
+    """Queries Google Scholar through SerpApi, cached for an hour.
+
+    :param query: normalized search query
+    :type query: str
+    :return: links of the first 5 results
+    :rtype: tuple
+    """
+    params = {
+        "engine": "google_scholar",
+        "q": query,
+        "api_key": settings().serp_api_key,
+        "num": 5,
+        "hl": "en",
+        # Let SerpApi trim the response down to the links we use
+        "json_restrictor": "organic_results[].link",
+    }
+    search = GoogleSearch(params)
+    result = search.get_dict()
+    return tuple(
+        res["link"] for res in result.get("organic_results", [])[:5] if res.get("link")
+    )
+
+
 def show_literature(query: str) -> str:
     """
-    Search Google Scholar for a variant/gene query and return first 5 paper links.
+    Search Google Scholar for a variant/gene query and return first 5 paper links as JSON.
     """
     try:
-        params = {
-            "engine": "google_scholar",
-            "q": query,
-            "api_key": SERP_API_KEY,
-            "num": 5,
-            "hl": "en",
-        }
-        search = GoogleSearch(params)
-        result = search.get_dict()
-        links = [
-            res.get("link") for res in result.get("organic_results", [])[:5]
-        ]
-        text = "\n".join(links) or "No links found."
-        return text
+        links = _search_scholar(" ".join(query.lower().split()))
+        if links:
+            return _to_json({"query": query, "links": list(links)})
+        return _to_json({"error": "No links found."})
     except Exception as e:
-        return f"Error in show_literature: {e}"
+        return _to_json({"error": f"Error in show_literature: {e}"})
 
 
 # 2. Clinical significance via myvariant.info
@@ -37,30 +93,33 @@ def get_clinical_info(variant_id: str) -> str:
 
     :param variant_id: variant identifier, e.g. 'chr9:g.107620835G>A'
     :type variant_id: str
-    :return: clinical significance terms
+    :return: JSON with the clinical significance terms, or an error
     :rtype: str
     """
     try:
-        mv = MyVariantInfo()
-        variant_data = mv.getvariant(variant_id)
-        significances = ""
+        variant_data = _fetch_variant(variant_id)
 
         # Path where clinical significance is usually stored in myvariant.info
         clinvar_data = variant_data.get("clinvar", {})
 
-        # 'rcv' field contains list of reports
-        for record in clinvar_data.get("rcv", []):
-            sig = record.get("clinical_significance")
-            if sig:
-                significances += sig + ", "
+        # 'rcv' field contains list of reports, many of them repeating the same term
+        significances = {
+            record["clinical_significance"]
+            for record in clinvar_data.get("rcv", [])
+            if record.get("clinical_significance")
+        }
 
-        return (
-            f"Clinical significance results of the {variant_id}, reported and interpreted by studies: {significances[:-2]}"
-            if significances
-            else "No clinical significance found. Please check your variant ID"
+        if significances:
+            return _to_json(
+                {"variant_id": variant_id, "clinical_significance": sorted(significances)}
+            )
+        return _to_json(
+            {"error": "No clinical significance found. Please check your variant ID"}
         )
     except Exception as e:
-        return f"Error in extracting clinical significance. Please check your variant ID: {e}"
+        return _to_json(
+            {"error": f"Error in extracting clinical significance. Please check your variant ID: {e}"}
+        )
 
 
 # 3. Get variant genetic consequence via myvariant.info
@@ -70,23 +129,26 @@ def get_consequence_info(variant_id: str) -> str:
 
     :param variant_id: variant identifier, e.g. 'chr1:g.11856378G>A'
     :type variant_id: str
-    :return: consequence terms
+    :return: JSON with the consequence terms, or an error
     :rtype: str
     """
     try:
-        mv = MyVariantInfo()
-        variant_data = mv.getvariant(variant_id)
+        variant_data = _fetch_variant(variant_id)
 
         # Get consequence list from CADD data
         consequence = variant_data.get("cadd", {}).get("consequence", [])
 
         if consequence:
-            return f"Predicted {variant_id} genetic consequences are {', '.join(consequence)}"
+            return _to_json({"variant_id": variant_id, "consequence": consequence})
         else:
-            return "No consequence data found. Please check your variant ID"
+            return _to_json(
+                {"error": "No consequence data found. Please check your variant ID"}
+            )
 
     except Exception as e:
-        return f"Error in extracting consequence data. Please check your variant ID: {e}"
+        return _to_json(
+            {"error": f"Error in extracting consequence data. Please check your variant ID: {e}"}
+        )
 
 
 # 4. Get gene name via myvariant.info
@@ -96,24 +158,25 @@ def get_gene_name(variant_id: str) -> str:
 
     :param variant_id: variant identifier, e.g. 'chr1:g.11856378G>A'
     :type variant_id: str
-    :return: gene names
+    :return: JSON with the gene names, or an error
     :rtype: str
     """
     try:
-        mv = MyVariantInfo()
-        variant_data = mv.getvariant(variant_id)
+        variant_data = _fetch_variant(variant_id)
 
         # Extract gene names from 'gene' list
         data = variant_data.get("cadd", {}).get("gene", [])
         gene_name = [item["genename"] for item in data if "genename" in item]
         if gene_name:
-            return f"{variant_id} is located and associated with: {', '.join(gene_name)}"
+            return _to_json({"variant_id": variant_id, "gene_name": gene_name})
         else:
-            return "No gene name found. Please check your variant ID"
+            return _to_json(
+                {"error": "No gene name found. Please check your variant ID"}
+            )
 
     except Exception as e:
-        return (
-            f"Error in extracting gene name. Please check your variant ID: {e}"
+        return _to_json(
+            {"error": f"Error in extracting gene name. Please check your variant ID: {e}"}
         )
 
 
@@ -187,3 +250,104 @@ tools = [
         },
     },
 ]
+
+DISPATCH = {
+    "show_literature": show_literature,
+    "get_clinical_info": get_clinical_info,
+    "get_consequence_info": get_consequence_info,
+    "get_gene_name": get_gene_name,
+}
+
+
+def unknown_tool(**_):
+    return _to_json({"error": "Unknown tool"})
+
+
+def run_tool_call(name: str, arguments: str) -> str:
+    """Runs a tool call produced by the model.
+
+    Malformed arguments are reported as an error result of that call, so one
+    bad call does not abort the others of the same turn or batch.
+
+    :param name: tool name
+    :type name: str
+    :param arguments: JSON-encoded keyword arguments
+    :type arguments: str
+    :return: tool result JSON, or an error
+    :rtype: str
+    """
+    try:
+        kwargs = json.loads(arguments)
+        return DISPATCH.get(name, unknown_tool)(**kwargs)
+    except (TypeError, ValueError) as e:
+        return _to_json({"error": f"Invalid arguments for {name}: {e}"})
+
+
+VARIANT_PATTERN = re.compile(r"chr[\dXYM]+:g\.\d+[ACGT]>[ACGT]")
+ROUTE_KEYWORDS = {
+    "get_clinical_info": re.compile(r"\bclinical(ly)?\b|\bsignificance\b|\bpathogenic", re.I),
+    "get_gene_name": re.compile(r"\bgenes?\b", re.I),
+    "get_consequence_info": re.compile(r"\bconsequences?\b", re.I),
+    "show_literature": re.compile(r"\bpapers?\b|\bliterature\b|\bscholar\b|\bpublications?\b", re.I),
+}
+# Request phrasing dropped from literature queries, keeping the topic words for Google Scholar
+LITERATURE_FILLER = re.compile(r"\b(?:find|search|show|list|get|give|me|about|on|for|any|some)\b", re.I)
+
+
+# Any variant mention: rsIDs and HGVS g./c./p./n./m./r. descriptions (SNVs, del/dup/ins/delins...),
+# optionally prefixed by a reference sequence such as 'chr9:' or 'NM_000518.5:'
+VARIANT_MENTION_PATTERN = re.compile(
+    r"\brs\d+\b|(?:\b[\w.]+:)?\b[cgmnpr]\.(?=[^\s,;]*\d)[^\s,;]*[\w)=*]", re.I
+)
+
+
+def variant_mentions(prompt: str) -> str:
+    """Normalized variant mentions of a prompt, as a key for scoping cached answers.
+
+    :param prompt: user prompt
+    :type prompt: str
+    :return: sorted, comma-separated, upper-cased mentions; empty if there are none
+    :rtype: str
+    """
+    return ",".join(
+        sorted({mention.upper() for mention in VARIANT_MENTION_PATTERN.findall(prompt)})
+    )
+
+
+def route_prompt(prompt: str):
+    """Picks a tool for prompts that unambiguously ask about one variant.
+
+    The prompt must contain exactly one HGVS variant identifier and keywords
+    of exactly one tool; anything else is left to the LLM.
+
+    :param prompt: user prompt
+    :type prompt: str
+    :return: tool name and arguments, or None if ambiguous
+    :rtype: tuple or None
+    """
+    variants = set(VARIANT_PATTERN.findall(prompt))
+    matched = [name for name, pattern in ROUTE_KEYWORDS.items() if pattern.search(prompt)]
+    if len(variants) != 1 or len(matched) != 1:
+        return None
+
+    fn_name = matched[0]
+    variant_id = variants.pop()
+    if fn_name == "show_literature":
+        # Keep the rest of the prompt (e.g. a disease), as the LLM router would
+        query = LITERATURE_FILLER.sub(" ", ROUTE_KEYWORDS[fn_name].sub(" ", prompt))
+        return fn_name, {"query": " ".join(query.split()).strip(" ?!.")}
+    return fn_name, {"variant_id": variant_id}
+
+
+def is_tool_error(result: str) -> bool:
+    """Checks whether a tool result reports an error.
+
+    :param result: JSON returned by one of the tools
+    :type result: str
+    :return: True if the result has an 'error' field or is not valid JSON
+    :rtype: bool
+    """
+    try:
+        return "error" in json.loads(result)
+    except (TypeError, ValueError):
+        return True
@@ -0,0 +1,170 @@
+import json
+import threading
+from unittest.mock import patch, MagicMock
+from function_calls import DISPATCH, tools
+from batch_annotation import (
+    build_batch_requests,
+    build_tool_followups,
+    read_batch_output,
+    submit_batch,
+)
+
+
+def test_build_batch_requests():
+    requests = build_batch_requests(["q1", "q2"], "system", "gpt-3.5-turbo")
+
+    assert [r["custom_id"] for r in requests] == ["0", "1"]
+    assert requests[1]["url"] == "/v1/chat/completions"
+    assert requests[1]["body"]["messages"] == [
+        {"role": "system", "content": "system"},
+        {"role": "user", "content": "q2"},
+    ]
+    assert requests[1]["body"]["tools"] == tools
+
+
+def test_submit_batch_uploads_jsonl():
+    client = MagicMock()
+    client.files.create.return_value.id = "file-1"
+    requests = build_batch_requests(["q1", "q2"], "system", "gpt-3.5-turbo")
+
+    submit_batch(client, requests)
+
+    uploaded = client.files.create.call_args.kwargs["file"][1].decode("utf-8")
+    assert [json.loads(line) for line in uploaded.splitlines()] == requests
+    client.batches.create.assert_called_once_with(
+        input_file_id="file-1",
+        endpoint="/v1/chat/completions",
+        completion_window="24h",
+    )
+
+
+def test_read_batch_output_marks_failures():
+    client = MagicMock()
+    batch = MagicMock(output_file_id="out", error_file_id="err")
+    outputs = {
+        "out": json.dumps(
+            {
+                "custom_id": "0",
+                "response": {
+                    "status_code": 200,
+                    "body": {"choices": [{"message": {"role": "assistant", "content": "Benign"}}]},
+                },
+                "error": None,
+            }
+        ),
+        "err": json.dumps(
+            {"custom_id": "1", "response": None, "error": {"message": "failed"}}
+        ),
+    }
+    client.files.content.side_effect = lambda file_id: MagicMock(text=outputs[file_id])
+
+    messages = read_batch_output(client, batch)
+
+    assert messages == {"0": {"role": "assistant", "content": "Benign"}, "1": None}
+
+
+def test_build_tool_followups_runs_tools():
+    requests = build_batch_requests(["q1", "q2"], "system", "gpt-3.5-turbo")
+    tool_call = {
+        "id": "call_1",
+        "type": "function",
+        "function": {
+            "name": "get_gene_name",
+            "arguments": json.dumps({"variant_id": "chr1:g.11856378G>A"}),
+        },
+    }
+    messages = {
+        "0": {"role": "assistant", "content": None, "tool_calls": [tool_call]},
+        "1": {"role": "assistant", "content": "No tools needed"},
+    }
+    mock_gene_name = MagicMock(return_value="MTHFR")
+
+    with patch.dict(DISPATCH, {"get_gene_name": mock_gene_name}):
+        followups = build_tool_followups(requests, messages)
+
+    mock_gene_name.assert_called_once_with(variant_id="chr1:g.11856378G>A")
+    assert len(followups) == 1
+    assert followups[0]["custom_id"] == "0"
+    assert "tools" not in followups[0]["body"]
+    assert followups[0]["body"]["messages"][-1] == {
+        "role": "tool",
+        "tool_call_id": "call_1",
+        "content": "MTHFR",
+    }
+
+
+def test_build_tool_followups_runs_tools_concurrently():
+    requests = build_batch_requests(["q1", "q2"], "system", "gpt-3.5-turbo")
+    messages = {
+        str(i): {
+            "role": "assistant",
+            "content": None,
+            "tool_calls": [
+                {
+                    "id": f"call_{i}",
+                    "type": "function",
+                    "function": {
+                        "name": "get_gene_name",
+                        "arguments": json.dumps({"variant_id": f"chr1:g.{i}G>A"}),
+                    },
+                }
+            ],
+        }
+        for i in range(2)
+    }
+    # Both lookups must be in flight at the same time to pass the barrier
+    barrier = threading.Barrier(2, timeout=5)
+
+    def gene_name(variant_id):
+        barrier.wait()
+        return variant_id
+
+    with patch.dict(DISPATCH, {"get_gene_name": gene_name}):
+        followups = build_tool_followups(requests, messages)
+
+    assert [f["body"]["messages"][-1]["content"] for f in followups] == [
+        "chr1:g.0G>A",
+        "chr1:g.1G>A",
+    ]
+
+
+def test_build_tool_followups_reports_bad_tool_calls():
+    requests = build_batch_requests(["q1"], "system", "gpt-3.5-turbo")
+    tool_calls = [
+        {
+            "id": "call_bad_json",
+            "type": "function",
+            "function": {"name": "get_gene_name", "arguments": '{"variant_id": '},
+        },
+        {
+            "id": "call_bad_name",
+            "type": "function",
+            "function": {
+                "name": "get_gene_name",
+                "arguments": json.dumps({"variant": "chr1:g.11856378G>A"}),
+            },
+        },
+        {
+            "id": "call_good",
+            "type": "function",
+            "function": {
+                "name": "get_gene_name",
+                "arguments": json.dumps({"variant_id": "chr1:g.11856378G>A"}),
+            },
+        },
+    ]
+    messages = {"0": {"role": "assistant", "content": None, "tool_calls": tool_calls}}
+
+    with patch.dict(DISPATCH, {"get_gene_name": lambda variant_id: "MTHFR"}):
+        followups = build_tool_followups(requests, messages)
+
+    # One malformed call is answered with an error and does not abort the batch
+    tool_msgs = followups[0]["body"]["messages"][-3:]
+    assert [msg["tool_call_id"] for msg in tool_msgs] == [
+        "call_bad_json",
+        "call_bad_name",
+        "call_good",
+    ]
+    assert "error" in json.loads(tool_msgs[0]["content"])
+    assert "error" in json.loads(tool_msgs[1]["content"])
+    assert tool_msgs[2]["content"] == "MTHFR"
@@ -0,0 +1,30 @@
+import os
+from unittest.mock import patch
+from config import settings
+
+
+@patch.dict("os.environ", {"OPENAI_API_KEY": "sk-test", "SERP_API_KEY": "serp-test"}, clear=True)
+@patch("config.load_dotenv")
+def test_settings_loaded_once(mock_load_dotenv):
+    settings.cache_clear()
+
+    first = settings()
+    second = settings()
+
+    assert first is second
+    assert first.openai_api_key == "sk-test"
+    assert first.serp_api_key == "serp-test"
+    assert first.langsmith_api_key is None
+    mock_load_dotenv.assert_called_once()
+    settings.cache_clear()
+
+
+@patch.dict("os.environ", {"LANGSMITH_API_KEY": "ls-test"}, clear=True)
+@patch("config.load_dotenv")
+def test_settings_enables_tracing_with_langsmith_key(mock_load_dotenv):
+    settings.cache_clear()
+    settings()
+
+    assert os.environ["LANGSMITH_TRACING"] == "true"
+    assert os.environ["LANGSMITH_PROJECT"] == "RAG_Variant_Interpretation_Assistant"
+    settings.cache_clear()
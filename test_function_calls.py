@@ -1,58 +1,96 @@
+import json
+import time
 import pytest
+from concurrent.futures import ThreadPoolExecutor
 from unittest.mock import patch, MagicMock
-from function_calls import get_clinical_info, show_literature, get_consequence_info, get_gene_name
+from function_calls import get_clinical_info, show_literature, get_consequence_info, get_gene_name, _fetch_variant, _search_scholar, VARIANT_FIELDS, route_prompt, is_tool_error, variant_mentions
 
 
-@patch("function_calls.MyVariantInfo")
-def test_get_clinical_info_with_significance(mock_myvariant):
+@pytest.fixture(autouse=True)
+def clear_caches():
+    _fetch_variant.cache_clear()
+    _search_scholar.cache_clear()
+    yield
+    _fetch_variant.cache_clear()
+    _search_scholar.cache_clear()
+
+
+@patch("function_calls._MV")
+def test_get_clinical_info_with_significance(mock_mv):
     # Mock response with clinical significance
-    mock_mv = MagicMock()
     mock_mv.getvariant.return_value = {
         "clinvar": {
             "rcv": [
                 {"clinical_significance": "Benign"},
-                {"clinical_significance": "Benign"},
+                {"clinical_significance": "Likely benign"},
                 {"clinical_significance": "Benign"},
                 {"clinical_significance": "Benign"},
             ]
         }
     }
-    mock_myvariant.return_value = mock_mv
 
-    result = get_clinical_info("chr9:g.107620835G>A")
+    result = json.loads(get_clinical_info("chr9:g.107620835G>A"))
 
-    # Assertions
-    assert result.count("Benign") == 4
-    assert result.startswith(
-        "Clinical significance results of the chr9:g.107620835G>A"
-    )
+    # Assertions: repeated terms are reported once
+    assert result == {
+        "variant_id": "chr9:g.107620835G>A",
+        "clinical_significance": ["Benign", "Likely benign"],
+    }
 
 
-@patch("function_calls.MyVariantInfo")
-def test_get_clinical_info_no_rcv_field(mock_myvariant):
+@patch("function_calls._MV")
+def test_get_clinical_info_no_rcv_field(mock_mv):
     # Mock response with no 'rcv' field
-    mock_mv = MagicMock()
     mock_mv.getvariant.return_value = {"clinvar": {}}
-    mock_myvariant.return_value = mock_mv
 
-    result = get_clinical_info("chr9:g.107620835G>C")
-    assert result.startswith(
-        "No clinical significance found. Please check your variant ID"
-    )
+    result = json.loads(get_clinical_info("chr9:g.107620835G>C"))
+    assert result == {
+        "error": "No clinical significance found. Please check your variant ID"
+    }
 
 
-@patch("function_calls.MyVariantInfo")
-def test_get_clinical_info_exception(mock_myvariant):
+@patch("function_calls._MV")
+def test_get_clinical_info_exception(mock_mv):
     # Simulate exception in myvariant
-    mock_mv = MagicMock()
     mock_mv.getvariant.side_effect = Exception("API error")
-    mock_myvariant.return_value = mock_mv
-    result = get_clinical_info("chr9:g.107620835G>C")
-    assert result.startswith(
+    result = json.loads(get_clinical_info("chr9:g.107620835G>C"))
+    assert result["error"].startswith(
         "Error in extracting clinical significance. Please check your variant ID:"
     )
 
 
+@patch("function_calls._MV")
+def test_variant_lookups_share_cache(mock_mv):
+    # Different tools asking about the same variant hit the API once
+    mock_mv.getvariant.return_value = {
+        "cadd": {"consequence": ["NON_SYNONYMOUS"], "gene": [{"genename": "MTHFR"}]}
+    }
+
+    get_consequence_info("chr1:g.11856378G>A")
+    get_gene_name("chr1:g.11856378G>A")
+
+    mock_mv.getvariant.assert_called_once_with("chr1:g.11856378G>A", fields=VARIANT_FIELDS)
+
+
+@patch("function_calls._MV")
+def test_concurrent_variant_lookups_share_cache(mock_mv):
+    # Tools run in parallel for one variant must wait for a single fetch, not each miss
+    def slow_getvariant(variant_id, fields):
+        time.sleep(0.2)
+        return {"cadd": {"consequence": ["NON_SYNONYMOUS"], "gene": [{"genename": "MTHFR"}]}}
+
+    mock_mv.getvariant.side_effect = slow_getvariant
+
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        futures = [
+            executor.submit(tool, "chr1:g.11856378G>A")
+            for tool in (get_consequence_info, get_gene_name, get_clinical_info)
+        ]
+    [future.result() for future in futures]
+
+    mock_mv.getvariant.assert_called_once_with("chr1:g.11856378G>A", fields=VARIANT_FIELDS)
+
+
 @patch("function_calls.GoogleSearch")
 def test_show_literature_returns_links(mock_search):
     """Test show_literature returns 5 links when API responds with organic results."""
@@ -71,19 +109,17 @@ def test_show_literature_returns_links(mock_search):
     mock_search.return_value = mock_instance
 
     # Call function
-    result = show_literature("BRCA1 variant")
+    result = json.loads(show_literature("BRCA1 variant"))
 
     # Assert output contains all links
-    expected = "\n".join(
-        [
-            "http://paper1.com",
-            "http://paper2.com",
-            "http://paper3.com",
-            "http://paper4.com",
-            "http://paper5.com",
-        ]
-    )
-    assert result == expected
+    expected = [
+        "http://paper1.com",
+        "http://paper2.com",
+        "http://paper3.com",
+        "http://paper4.com",
+        "http://paper5.com",
+    ]
+    assert result == {"query": "BRCA1 variant", "links": expected}
 
 
 @patch("function_calls.GoogleSearch")
@@ -94,8 +130,23 @@ def test_show_literature_no_results(mock_search):
     mock_instance.get_dict.return_value = {"organic_results": []}
     mock_search.return_value = mock_instance
 
-    result = show_literature("nonexistent gene")
-    assert result == "No links found."
+    result = json.loads(show_literature("nonexistent gene"))
+    assert result == {"error": "No links found."}
+
+@patch("function_calls.GoogleSearch")
+def test_show_literature_caches_normalized_query(mock_search):
+    """Test show_literature reuses results for queries differing in case/whitespace."""
+
+    mock_instance = MagicMock()
+    mock_instance.get_dict.return_value = {
+        "organic_results": [{"link": "http://paper1.com"}]
+    }
+    mock_search.return_value = mock_instance
+
+    assert json.loads(show_literature("BRCA1 variant"))["links"] == ["http://paper1.com"]
+    assert json.loads(show_literature("  brca1   Variant "))["links"] == ["http://paper1.com"]
+    mock_search.assert_called_once()
+    assert mock_search.call_args.args[0]["q"] == "brca1 variant"
 
 @patch("function_calls.GoogleSearch")
 def test_show_literature_error(mock_search):
@@ -103,53 +154,49 @@ def test_show_literature_error(mock_search):
 
     mock_search.side_effect = Exception("API failure")
 
-    result = show_literature("TP53 variant")
-    assert result.startswith("Error in show_literature:")
+    result = json.loads(show_literature("TP53 variant"))
+    assert result["error"].startswith("Error in show_literature:")
 
 
-@patch("function_calls.MyVariantInfo")
-def test_get_consequence_info_success(mock_myvariant):
+@patch("function_calls._MV")
+def test_get_consequence_info_success(mock_mv):
     # Mock a response with consequence data
-    mock_mv = MagicMock()
     mock_mv.getvariant.return_value = {
         "cadd": {"consequence": ["NON_SYNONYMOUS", "REGULATORY"]}
     }
-    mock_myvariant.return_value = mock_mv
 
-    result = get_consequence_info("chr1:g.11856378G>A")
+    result = json.loads(get_consequence_info("chr1:g.11856378G>A"))
 
-    assert "Predicted chr1:g.11856378G>A genetic consequences are NON_SYNONYMOUS, REGULATORY" in result
+    assert result == {
+        "variant_id": "chr1:g.11856378G>A",
+        "consequence": ["NON_SYNONYMOUS", "REGULATORY"],
+    }
 
 
-@patch("function_calls.MyVariantInfo")
-def test_get_consequence_info_no_data(mock_myvariant):
+@patch("function_calls._MV")
+def test_get_consequence_info_no_data(mock_mv):
     # Mock a response without consequence field
-    mock_mv = MagicMock()
     mock_mv.getvariant.return_value = {"cadd": {}}
-    mock_myvariant.return_value = mock_mv
 
-    result = get_consequence_info("chr1:g.11856378G>A")
+    result = json.loads(get_consequence_info("chr1:g.11856378G>A"))
 
-    assert result == "No consequence data found. Please check your variant ID"
+    assert result == {"error": "No consequence data found. Please check your variant ID"}
 
 
-@patch("function_calls.MyVariantInfo")
-def test_get_consequence_info_exception(mock_myvariant):
+@patch("function_calls._MV")
+def test_get_consequence_info_exception(mock_mv):
     # Simulate an exception in getvariant
-    mock_mv = MagicMock()
     mock_mv.getvariant.side_effect = Exception("API error")
-    mock_myvariant.return_value = mock_mv
 
-    result = get_consequence_info("chr1:g.11856378G>A")
+    result = json.loads(get_consequence_info("chr1:g.11856378G>A"))
 
-    assert result.startswith("Error in extracting consequence data. Please check your variant ID:")
-    assert "API error" in result
+    assert result["error"].startswith("Error in extracting consequence data. Please check your variant ID:")
+    assert "API error" in result["error"]
 
 
-@patch("function_calls.MyVariantInfo")
-def test_get_gene_name_success(mock_myvariant):
+@patch("function_calls._MV")
+def test_get_gene_name_success(mock_mv):
     # Mock response with gene names
-    mock_mv = MagicMock()
     mock_mv.getvariant.return_value = {
         "cadd": {
             "gene": [
@@ -159,33 +206,113 @@ def test_get_gene_name_success(mock_myvariant):
             ]
         }
     }
-    mock_myvariant.return_value = mock_mv
 
-    result = get_gene_name("chr1:g.11856378G>A")
+    raw = get_gene_name("chr1:g.11856378G>A")
+    result = json.loads(raw)
 
-    assert result == "chr1:g.11856378G>A is located and associated with: MTHFR, BRCA1"
+    assert result == {"variant_id": "chr1:g.11856378G>A", "gene_name": ["MTHFR", "BRCA1"]}
+    # Compact separators keep the tokens sent back to the LLM low
+    assert raw == '{"variant_id":"chr1:g.11856378G>A","gene_name":["MTHFR","BRCA1"]}'
 
 
-@patch("function_calls.MyVariantInfo")
-def test_get_gene_name_no_data(mock_myvariant):
+@patch("function_calls._MV")
+def test_get_gene_name_no_data(mock_mv):
     # Mock response without any gene names
-    mock_mv = MagicMock()
     mock_mv.getvariant.return_value = {"cadd": {"gene": [{"feature_id": "ENSR00000279227"}]}}
-    mock_myvariant.return_value = mock_mv
 
-    result = get_gene_name("chr1:g.11856378G>A")
+    result = json.loads(get_gene_name("chr1:g.11856378G>A"))
 
-    assert result == "No gene name found. Please check your variant ID"
+    assert result == {"error": "No gene name found. Please check your variant ID"}
 
 
-@patch("function_calls.MyVariantInfo")
-def test_get_gene_name_exception(mock_myvariant):
+@patch("function_calls._MV")
+def test_get_gene_name_exception(mock_mv):
     # Simulate exception in getvariant
-    mock_mv = MagicMock()
     mock_mv.getvariant.side_effect = Exception("API error")
-    mock_myvariant.return_value = mock_mv
 
-    result = get_gene_name("chr1:g.11856378G>A")
+    result = json.loads(get_gene_name("chr1:g.11856378G>A"))
+
+    assert result["error"].startswith("Error in extracting gene name. Please check your variant ID:")
+    assert "API error" in result["error"]
+
+
+@pytest.mark.parametrize(
+    "prompt, expected",
+    [
+        (
+            "What is the clinical significance of chr9:g.107620835G>A?",
+            ("get_clinical_info", {"variant_id": "chr9:g.107620835G>A"}),
+        ),
+        (
+            "Which gene is chr1:g.11856378G>A in?",
+            ("get_gene_name", {"variant_id": "chr1:g.11856378G>A"}),
+        ),
+        (
+            "Predicted genetic consequence of chr1:g.11856378G>A",
+            ("get_consequence_info", {"variant_id": "chr1:g.11856378G>A"}),
+        ),
+        (
+            "Find papers about chrX:g.1000A>T",
+            ("show_literature", {"query": "chrX:g.1000A>T"}),
+        ),
+        (
+            "Show me papers about chr9:g.107620835G>A in breast cancer?",
+            ("show_literature", {"query": "chr9:g.107620835G>A in breast cancer"}),
+        ),
+        (
+            "Literature on chr1:g.11856378G>A and folate metabolism",
+            ("show_literature", {"query": "chr1:g.11856378G>A and folate metabolism"}),
+        ),
+    ],
+)
+def test_route_prompt_unambiguous(prompt, expected):
+    assert route_prompt(prompt) == expected
+
+
+@pytest.mark.parametrize(
+    "prompt",
+    [
+        "What is the clinical significance of BRCA1 variants?",
+        "Gene and clinical significance of chr9:g.107620835G>A",
+        "Compare the consequence of chr1:g.11856378G>A and chr9:g.107620835G>A",
+        "Tell me about chr9:g.107620835G>A",
+    ],
+)
+def test_route_prompt_ambiguous(prompt):
+    assert route_prompt(prompt) is None
+
+
+@patch("function_calls._MV")
+def test_is_tool_error(mock_mv):
+    mock_mv.getvariant.return_value = {"cadd": {"gene": [{"genename": "MTHFR"}]}}
+    assert not is_tool_error(get_gene_name("chr1:g.11856378G>A"))
 
-    assert result.startswith("Error in extracting gene name. Please check your variant ID:")
-    assert "API error" in result
\ No newline at end of file
+    mock_mv.getvariant.side_effect = Exception("API error")
+    assert is_tool_error(get_clinical_info("chr9:g.107620835G>A"))
+    assert is_tool_error("not json")
+
+
+@pytest.mark.parametrize(
+    "prompt, other",
+    [
+        (
+            "Clinical significance of chr7:g.117559590_117559592del?",
+            "Clinical significance of chr7:g.117559590_117559593del?",
+        ),
+        ("Is rs334 pathogenic?", "Is rs335 pathogenic?"),
+        ("Gene of NM_000518.5:c.20A>T", "Gene of NM_000518.5:c.20A>G"),
+        ("Consequence of chr9:g.107620835g>a", "Consequence of chr9:g.107620836g>a"),
+        ("Papers on BRCA1:c.68_69dupAG", "Papers on BRCA1:c.68_69insAG"),
+    ],
+)
+def test_variant_mentions_distinguish_variants(prompt, other):
+    # Prompts differing only in the variant must never share a cached answer
+    assert variant_mentions(prompt)
+    assert variant_mentions(prompt) != variant_mentions(other)
+
+
+def test_variant_mentions_normalize():
+    assert variant_mentions("chr9:g.107620835g>a or RS334, e.g. chr9:g.107620835G>A") == (
+        "CHR9:G.107620835G>A,RS334"
+    )
+    assert variant_mentions("What does the ACMG PM2 criterion mean?") == ""